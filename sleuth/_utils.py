@@ -1,8 +1,10 @@
 import warnings
 import torch
+import torch.optim as optim
 import random
 import numpy as np
 import pandas as pd
+from scipy.sparse import issparse
 from sklearn import metrics
 from typing import Union
 
@@ -15,6 +17,12 @@ def seed_everything(seed):
     torch.backends.cudnn.deterministic = True
 
 
+def allow_tf32():
+    torch.set_float32_matmul_precision('high')
+    torch.backends.cuda.matmul.allow_tf32 = True
+    torch.backends.cudnn.allow_tf32 = True
+
+
 def clear_warnings(category=FutureWarning):
     def outwrapper(func):
         def wrapper(*args, **kwargs):
@@ -43,6 +51,112 @@ def select_device(GPU: Union[bool, str] = True,):
     return device
 
 
+def should_log(epoch: int, epochs: int, interval: int):
+    """
+    Whether to read the losses back for the progress bar, which synchronizes with the GPU
+    """
+    return (epoch + 1) % interval == 0 or epoch + 1 == epochs
+
+
+def to_tensor(X):
+    """
+    Convert an expression matrix into a float32 tensor, sharing memory with NumPy when possible
+    """
+    if issparse(X):
+        X = X.toarray()
+    return torch.from_numpy(np.ascontiguousarray(X, dtype=np.float32))
+
+
+def compile_module(module, device: torch.device, enabled: bool = True, **kwargs):
+    """
+    Compile a module (or method) with torch.compile when enabled and training on a GPU
+    """
+    if enabled and device.type == 'cuda' and hasattr(torch, 'compile'):
+        return torch.compile(module, **kwargs)
+    return module
+
+
+def build_adam(params, learning_rate: float, device: torch.device, **kwargs):
+    """
+    Build an Adam optimizer, fused into a single kernel per step on GPUs
+    """
+    return optim.Adam(params, lr=learning_rate, betas=(0.5, 0.999),
+                      fused=device.type == 'cuda', **kwargs)
+
+
+def fits_device(data: torch.Tensor, device: torch.device, ratio: float = 0.5):
+    """
+    Check whether a tensor can be kept resident on the device
+    """
+    if device.type != 'cuda':
+        return True
+
+    free, _ = torch.cuda.mem_get_info(device)
+    return data.element_size() * data.numel() < free * ratio
+
+
+class DeviceLoader:
+    """
+    Iterate over mini-batches of a tensor already resident on the device
+    """
+    def __init__(self, data: torch.Tensor, batch_size: int,
+                 shuffle: bool = False, drop_last: bool = False):
+        self.data = data
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+
+    def __len__(self):
+        n = self.data.shape[0]
+        if self.drop_last:
+            return n // self.batch_size
+        return (n + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        n = self.data.shape[0]
+        stop = n - self.batch_size + 1 if self.drop_last else n
+
+        if self.shuffle:
+            perm = torch.randperm(n, device=self.data.device)
+            for i in range(0, stop, self.batch_size):
+                yield self.data[perm[i:i + self.batch_size]]
+        else:
+            for i in range(0, stop, self.batch_size):
+                yield self.data[i:i + self.batch_size]
+
+
+class PrefetchLoader:
+    """
+    Wrap a DataLoader to copy the next batch to the GPU on a side stream while the current one is used
+    """
+    def __init__(self, loader, device: torch.device):
+        self.loader = loader
+        self.device = device
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        stream = torch.cuda.Stream(self.device)
+        current = torch.cuda.current_stream(self.device)
+        pending = None
+
+        for data in self.loader:
+            with torch.cuda.stream(stream):
+                data = data.to(self.device, non_blocking=True)
+
+            if pending is not None:
+                yield pending
+
+            # compute on the new batch must wait for its copy to finish
+            current.wait_stream(stream)
+            data.record_stream(current)
+            pending = data
+
+        if pending is not None:
+            yield pending
+
+
 @clear_warnings()
 def evaluate(y_true, y_score):
     """
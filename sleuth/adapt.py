@@ -3,11 +3,10 @@ from tqdm import tqdm
 
 import torch
 import torch.nn as nn
-import torch.optim as optim
 from torch.utils.data import DataLoader, Dataset
 from torch.optim.lr_scheduler import CosineAnnealingLR
 
-from ._utils import seed_everything
+from ._utils import seed_everything, allow_tf32, should_log, to_tensor, build_adam
 from .model import Discriminator, GeneratorDA, GeneratorAD
 from .configs import AdaptConfigs
 
@@ -35,7 +34,10 @@ class AdaptModel:
         self.learning_rate = configs.learning_rate
         self.n_critic = configs.n_critic
         self.loss_weight = configs.loss_weight
+        self.log_interval = configs.log_interval
         self.device = configs.device
+        if self.device.type == 'cuda':
+            allow_tf32()
         
         # Initial model
         self._init_model(configs, num_batches)
@@ -56,7 +58,7 @@ class AdaptModel:
         self._train(self.n_epochs)
 
         # Generate data without domain shifts
-        dataset = torch.Tensor(tgt.X)
+        dataset = to_tensor(tgt.X)
         self.loader = DataLoader(dataset, batch_size=self.batch_size, shuffle=False,
                                  num_workers=4, pin_memory=True, drop_last=False)
 
@@ -64,7 +66,7 @@ class AdaptModel:
         corrected = []
         with torch.no_grad():
             for data in self.loader:
-                data = data.to(self.device)
+                data = data.to(self.device, non_blocking=True)
                 fake_ref = self.G(data)
                 corrected.append(fake_ref.cpu().detach())
 
@@ -77,8 +79,8 @@ class AdaptModel:
         self.D = Discriminator(**configs.Discriminator).to(self.device)
         self.G = GeneratorDA(num_batches, **configs.Generator).to(self.device)
 
-        self.opt_D = optim.Adam(self.D.parameters(), lr=self.learning_rate, betas=(0.5, 0.999))
-        self.opt_G = optim.Adam(self.G.parameters(), lr=self.learning_rate, betas=(0.5, 0.999))     
+        self.opt_D = build_adam(self.D.parameters(), self.learning_rate, self.device)
+        self.opt_G = build_adam(self.G.parameters(), self.learning_rate, self.device)
 
         self.sch_D = CosineAnnealingLR(self.opt_D, self.n_epochs)
         self.sch_G = CosineAnnealingLR(self.opt_G, self.n_epochs)
@@ -86,7 +88,7 @@ class AdaptModel:
         self.Loss = nn.L1Loss().to(self.device)
 
     def _check(self, ref, tgt, batch_key):
-        if (tgt.var_names != ref.var_names).any():
+        if not tgt.var_names.equals(ref.var_names):
             raise RuntimeError('Target and reference data have different genes!')
 
         if batch_key not in tgt.obs.columns:
@@ -94,8 +96,8 @@ class AdaptModel:
 
     @torch.no_grad()
     def _map(self, ref: ad.AnnData, tgt: ad.AnnData, generator: GeneratorAD):
-        ref_data = torch.Tensor(ref.X).to(self.device)
-        tgt_data = torch.Tensor(tgt.X).to(self.device)
+        ref_data = to_tensor(ref.X).to(self.device)
+        tgt_data = to_tensor(tgt.X).to(self.device)
 
         generator.eval()
         ref_e = generator(ref_data)
@@ -108,20 +110,21 @@ class AdaptModel:
     
     def _train(self, epochs):
         with tqdm(total=epochs) as t:
-            for _ in range(epochs):
+            for epoch in range(epochs):
                 t.set_description('Adaptation Epochs')
 
                 for data in self.loader:
-                    ref = data['ref'].to(self.device)
-                    tgt = data['tgt'].to(self.device)
+                    ref = data['ref'].to(self.device, non_blocking=True)
+                    tgt = data['tgt'].to(self.device, non_blocking=True)
 
                     for _ in range(self.n_critic):
                         self._UpdateD(ref, tgt)
 
                     self._UpdateG(ref, tgt)
         
-                t.set_postfix(G_Loss = self.G_loss.item(),
-                              D_Loss = self.D_loss.item())
+                if should_log(epoch, epochs, self.log_interval):
+                    t.set_postfix(G_Loss = self.G_loss.item(),
+                                  D_Loss = self.D_loss.item())
                 t.update(1)
                 self.sch_D.step()
                 self.sch_G.step()
@@ -129,12 +132,13 @@ class AdaptModel:
     def _UpdateD(self, ref, tgt):
         fake_ref = self.G(tgt)
 
-        d1 = torch.mean(self.D(ref))
-        d2 = torch.mean(self.D(fake_ref.detach()))
+        d = self.D(torch.cat([ref, fake_ref.detach()], dim=0))
+        d1 = torch.mean(d[:ref.shape[0]])
+        d2 = torch.mean(d[ref.shape[0]:])
         gp = self.D.gradient_penalty(ref, fake_ref.detach())
-        self.D_loss = - d1 + d2 + gp * self.weight['w_gp']
+        self.D_loss = - d1 + d2 + gp * self.loss_weight['w_gp']
 
-        self.opt_D.zero_grad()
+        self.opt_D.zero_grad(set_to_none=True)
         self.D_loss.backward()
         self.opt_D.step()
     
@@ -147,6 +151,6 @@ class AdaptModel:
         L_rec = self.Loss(ref, fake_ref)
         L_adv = - torch.mean(d)
         self.G_loss = self.loss_weight['w_rec']*L_rec+self.loss_weight['w_adv']*L_adv
-        self.opt_G.zero_grad()
+        self.opt_G.zero_grad(set_to_none=True)
         self.G_loss.backward()
         self.opt_G.step()
\ No newline at end of file
@@ -3,11 +3,11 @@ from tqdm import tqdm
 
 import torch
 import torch.nn as nn
-import torch.optim as optim
 from torch.utils.data import DataLoader
 from torch.optim.lr_scheduler import CosineAnnealingLR
 
-from ._utils import seed_everything
+from ._utils import seed_everything, allow_tf32, should_log, to_tensor, build_adam
+from ._utils import compile_module, fits_device, DeviceLoader, PrefetchLoader
 from .configs import AnomalyConfigs
 from .model import GeneratorAD, Discriminator, Scorer
 
@@ -24,7 +24,18 @@ class AnomalyModel:
         self.learning_rate = configs.learning_rate
         self.n_critic = configs.n_critic
         self.loss_weight = configs.loss_weight
+        self.log_interval = configs.log_interval
         self.device = configs.device
+        if self.device.type == 'cuda':
+            allow_tf32()
+
+        # Mixed precision is only used on GPUs, BF16 is preferred for GAN stability
+        # where it is native (Ampere and newer), otherwise FP16 is used
+        self.amp = configs.amp and self.device.type == 'cuda'
+        if self.amp and torch.cuda.get_device_capability(self.device)[0] >= 8:
+            self.amp_dtype = torch.bfloat16
+        else:
+            self.amp_dtype = torch.float16
 
         # Initial model
         self._init_model(configs, anomaly_ratio)
@@ -35,49 +46,54 @@ class AnomalyModel:
         tqdm.write('Begin to train ACSleuth on the reference dataset...')
 
         self.gene_names = ref.var_names
-        train_data = torch.Tensor(ref.X)
-        self.loader = DataLoader(train_data, batch_size=self.batch_size, shuffle=True,
-                                 num_workers=4, pin_memory=True, drop_last=True)
+        train_data = to_tensor(ref.X)
+        self.loader = self._build_loader(train_data, shuffle=True, drop_last=True)
+        # loss scaling is only needed for the narrow FP16 range
+        use_scaler = self.amp and self.amp_dtype == torch.float16
+        self.scaler_D = torch.amp.GradScaler('cuda', enabled=use_scaler)
+        self.scaler_G = torch.amp.GradScaler('cuda', enabled=use_scaler)
 
         self.D.train()
         self.G.train()
         self._train(self.prepare_epochs, 'Preparation Epochs', False)
         self._train(self.train_epochs, 'Training Epochs', True)
-        
+
+        # release the device copy of the reference data
+        self.loader = None
         tqdm.write('Training has been finished.')
 
     def predict(self, tgt: ad.AnnData):
         self._check(tgt)
 
         tqdm.write('Begin to detect anomalies on the target dataset...')
-        real_data = torch.Tensor(tgt.X)
-        self.loader = DataLoader(real_data, batch_size=self.batch_size, shuffle=False,
-                                 num_workers=4, pin_memory=True, drop_last=False)
+        real_data = to_tensor(tgt.X)
+        loader = self._build_loader(real_data, shuffle=False, drop_last=False)
 
         self.D.eval()
         self.G.eval()
-        fake_data = []
+        delta = torch.empty(real_data.shape, device=self.device)
+        offset = 0
 
         with torch.no_grad():
-            for data in self.loader:
-                data = data.to(self.device)
+            for data in loader:
+                data = data.to(self.device, non_blocking=True)
                 fake, _ = self.G(data)
-                fake_data.append(fake.detach())
-  
-        fake_data = torch.cat(fake_data, dim=0)
-        delta = real_data.to(self.device) - fake_data
+                delta[offset:offset + data.shape[0]] = data - fake.detach()
+                offset += data.shape[0]
 
         self.S.train()
         with tqdm(total=self.score_epochs) as t:
-            for _ in range(self.score_epochs):
+            for epoch in range(self.score_epochs):
                 t.set_description(f'Prediction Epochs')
 
-                _, loss = self.S(delta)
-                self.opt_S.zero_grad()
+                _, loss = self._S(delta)
+                self.opt_S.zero_grad(set_to_none=True)
                 loss.backward()
                 self.opt_S.step()
                 self.sch_S.step()
-                t.set_postfix(S_Loss = loss.item())
+
+                if should_log(epoch, self.score_epochs, self.log_interval):
+                    t.set_postfix(S_Loss = loss.item())
                 t.update(1)
 
         self.S.eval()
@@ -90,9 +106,16 @@ class AnomalyModel:
         self.G = GeneratorAD(**configs.Generator).to(self.device)
         self.S = Scorer(anomaly_ratio=anomaly_ratio, **configs.Scorer).to(self.device)
 
-        self.opt_D = optim.Adam(self.D.parameters(), lr=self.learning_rate, betas=(0.5, 0.999))
-        self.opt_G = optim.Adam(self.G.parameters(), lr=self.learning_rate, betas=(0.5, 0.999))
-        self.opt_S = optim.Adam(self.S.parameters(), lr=self.learning_rate, betas=(0.5, 0.999))        
+        # Compiled forwards for the training steps, the gradient penalty stays eager
+        # because compiled graphs do not support double backward
+        self._G = compile_module(self.G, self.device, configs.compile)
+        self._G_prepare = compile_module(self.G.prepare, self.device, configs.compile)
+        self._D = compile_module(self.D, self.device, configs.compile)
+        self._S = compile_module(self.S, self.device, configs.compile)
+
+        self.opt_D = build_adam(self.D.parameters(), self.learning_rate, self.device)
+        self.opt_G = build_adam(self.G.parameters(), self.learning_rate, self.device)
+        self.opt_S = build_adam(self.S.parameters(), self.learning_rate, self.device)
 
         self.sch_D = CosineAnnealingLR(self.opt_D, self.train_epochs)
         self.sch_G = CosineAnnealingLR(self.opt_G, self.train_epochs)
@@ -100,21 +123,36 @@ class AnomalyModel:
 
         self.Loss = nn.L1Loss().to(self.device)
 
+    def _build_loader(self, data, shuffle: bool, drop_last: bool):
+        # Keep the whole dataset on the device when it fits to skip per-batch copies
+        if fits_device(data, self.device):
+            return DeviceLoader(data.to(self.device), self.batch_size,
+                                shuffle=shuffle, drop_last=drop_last)
+
+        loader = DataLoader(data, batch_size=self.batch_size, shuffle=shuffle,
+                            num_workers=4, pin_memory=True, drop_last=drop_last)
+        return PrefetchLoader(loader, self.device)
+
+    def _autocast(self):
+        return torch.autocast(device_type=self.device.type, dtype=self.amp_dtype,
+                              enabled=self.amp)
+
     def _train(self, epochs, description, train: bool):
         with tqdm(total=epochs) as t:
-            for _ in range(epochs):
+            for epoch in range(epochs):
                 t.set_description(description)
 
                 for data in self.loader:
-                    data = data.to(self.device)
+                    data = data.to(self.device, non_blocking=True)
 
                     for _ in range(self.n_critic):
                         self._UpdateD(data, train)
 
                     self._UpdateG(data, train)
         
-                t.set_postfix(G_Loss = self.G_loss.item(),
-                              D_Loss = self.D_loss.item())
+                if should_log(epoch, epochs, self.log_interval):
+                    t.set_postfix(G_Loss = self.G_loss.item(),
+                                  D_Loss = self.D_loss.item())
                 t.update(1)
 
                 if train:
@@ -122,40 +160,51 @@ class AnomalyModel:
                     self.sch_G.step()
 
     def _UpdateD(self, data, train):
-        if train:
-            fake_data, _ = self.G(data)
-        else:
-            fake_data, _ = self.G.prepare(data)
-
-        d1 = torch.mean(self.D(data))
-        d2 = torch.mean(self.D(fake_data.detach()))
-        gp = self.D.gradient_penalty(data, fake_data.detach())
-        self.D_loss = - d1 + d2 + gp * self.weight['w_gp']
-
-        self.opt_D.zero_grad()
-        self.D_loss.backward()
-        self.opt_D.step()
+        with self._autocast():
+            # the fake samples are detached for D, so G needs no graph here
+            with torch.no_grad():
+                if train:
+                    fake_data, _ = self._G(data)
+                else:
+                    fake_data, _ = self._G_prepare(data)
+
+                d = self._D(torch.cat([data, fake_data.detach()], dim=0))
+            d1 = torch.mean(d[:data.shape[0]])
+            d2 = torch.mean(d[data.shape[0]:])
+
+        # gradient penalty stays out of autocast, its double backward is unstable in
+        # 16-bit floats (TF32 matmuls keep the FP32 range and still apply)
+        gp = self.D.gradient_penalty(data, fake_data.detach().float())
+        self.D_loss = - d1 + d2 + gp * self.loss_weight['w_gp']
+
+        self.opt_D.zero_grad(set_to_none=True)
+        self.scaler_D.scale(self.D_loss).backward()
+        self.scaler_D.step(self.opt_D)
+        self.scaler_D.update()
     
     def _UpdateG(self, data, train):
-        if train:
-            fake_data, z = self.G(data)
-        else:
-            fake_data, z = self.G.prepare(data)
+        with self._autocast():
+            if train:
+                fake_data, z = self._G(data)
+            else:
+                fake_data, z = self._G_prepare(data)
+
+            # discriminator provides feedback
+            d = self._D(fake_data)
 
-        # discriminator provides feedback
-        d = self.D(fake_data)
+            L_rec = self.Loss(data, fake_data)
+            L_adv = - torch.mean(d)
+            self.G_loss = self.loss_weight['w_rec']*L_rec+self.loss_weight['w_adv']*L_adv
 
-        L_rec = self.Loss(data, fake_data)
-        L_adv = - torch.mean(d)
-        self.G_loss = self.loss_weight['w_rec']*L_rec+self.loss_weight['w_adv']*L_adv
-        self.opt_G.zero_grad()
-        self.G_loss.backward()
-        self.opt_G.step()
+        self.opt_G.zero_grad(set_to_none=True)
+        self.scaler_G.scale(self.G_loss).backward()
+        self.scaler_G.step(self.opt_G)
+        self.scaler_G.update()
 
         self.G.Memory.update_mem(z)
 
     def _check(self, tgt: ad.AnnData):
-        if (tgt.var_names != self.genes).any():
+        if not tgt.var_names.equals(self.gene_names):
             raise RuntimeError('Target and reference data have different genes.')
 
         if (self.G is None or self.D is None):
@@ -168,22 +217,21 @@ class AnomalyModel:
         """
         self._check(tgt)
 
-        real_data = torch.Tensor(tgt.X)
-        self.loader = DataLoader(real_data, batch_size=self.batch_size, shuffle=False,
-                                 num_workers=4, pin_memory=True, drop_last=False)
+        real_data = to_tensor(tgt.X)
+        loader = self._build_loader(real_data, shuffle=False, drop_last=False)
 
         self.D.eval()
         self.G.eval()
-        fake_data = []
+        delta = torch.empty(real_data.shape[0], device=self.device)
+        offset = 0
         
         with torch.no_grad():
-            for data in self.loader:
-                data = data.to(self.device)
+            for data in loader:
+                data = data.to(self.device, non_blocking=True)
                 fake, _ = self.G.forward(data)
-                fake_data.append(fake.detach())
+                delta[offset:offset + data.shape[0]] = torch.norm(data - fake.detach(), dim=1, p=2)
+                offset += data.shape[0]
   
-        fake_data = torch.cat(fake_data, dim=0)
-        delta = torch.norm(real_data.to(self.device) - fake_data, dim=1, p=2).reshape(-1)
         return delta.cpu().detach().numpy()
     
     def D_score(self, tgt: ad.AnnData):
@@ -192,25 +240,22 @@ class AnomalyModel:
         """
         self._check(tgt)
 
-        real_data = torch.Tensor(tgt.X)
-        self.loader = DataLoader(real_data, batch_size=self.batch_size, shuffle=False,
-                                 num_workers=4, pin_memory=True, drop_last=False)
+        real_data = to_tensor(tgt.X)
+        loader = self._build_loader(real_data, shuffle=False, drop_last=False)
 
         self.D.eval()
         self.G.eval()
-        real_d, fake_d = [], []
+        delta = torch.empty(real_data.shape[0], device=self.device)
+        offset = 0
         
         with torch.no_grad():
-            for data in self.loader:
-                data = data.to(self.device)
+            for data in loader:
+                data = data.to(self.device, non_blocking=True)
                 fake, _ = self.G.forward(data)
 
-                r_d = self.D.forward(data)
-                real_d.append(r_d.detach())
-                f_d = self.D.forward(fake)
-                fake_d.append(f_d.detach())                
+                d = self.D.forward(torch.cat([data, fake], dim=0))
+                real_d, fake_d = d[:data.shape[0]], d[data.shape[0]:]
+                delta[offset:offset + data.shape[0]] = torch.norm(real_d - fake_d, dim=1, p=2)
+                offset += data.shape[0]
   
-        real_d = torch.cat(real_d, dim=0)
-        fake_d = torch.cat(fake_d, dim=0)
-        delta = torch.norm(real_d - fake_d, dim=1, p=2).reshape(-1)
         return delta.cpu().detach().numpy()
\ No newline at end of file
@@ -15,6 +15,9 @@ class AnomalyConfigs:
         self.learning_rate = 1e-4
         self.n_critic = 2
         self.loss_weight = {'w_rec': 30, 'w_adv': 1, 'w_gp': 10}
+        self.amp = True
+        self.compile = True
+        self.log_interval = 10
         self.device = select_device('cuda:0')
         self.random_state = 2024
 
@@ -50,6 +53,7 @@ class AdaptConfigs:
         self.learning_rate = 1e-4
         self.n_critic = 3
         self.loss_weight = {'w_rec': 30, 'w_adv': 1, 'w_gp': 10}
+        self.log_interval = 10
         self.device = select_device('cuda:0')
         self.random_state = 2024
 
@@ -75,6 +79,7 @@ class SubtypeConfigs:
         self.batch_size = 64
         self.learning_rate = 1e-4
         self.weight_decay = 1e-4
+        self.log_interval = 10
         self.device = select_device('cuda:0')
         self.random_state = 2024
 
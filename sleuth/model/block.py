@@ -11,10 +11,11 @@ class LinearBlock(nn.Module):
     def __init__(self, in_dim, out_dim,
                  norm = True, act = True, dropout = True):
         super().__init__()
+        # the bias would be cancelled by the mean subtraction of BatchNorm
         self.layer = nn.Sequential(
-            nn.Linear(in_dim, out_dim),
+            nn.Linear(in_dim, out_dim, bias=not norm),
             nn.BatchNorm1d(out_dim) if norm else nn.Identity(),
-            nn.LeakyReLU(0.2, inplace=True) if act else nn.Identity(),
+            nn.LeakyReLU(0.2) if act else nn.Identity(),
             nn.Dropout(0.1) if dropout else nn.Identity()
         )
 
@@ -31,7 +32,7 @@ class SNLinearBlock(nn.Module):
         self.layer = nn.Sequential(
             SNorm(nn.Linear(in_dim, out_dim))
             if norm else nn.Linear(in_dim, out_dim),
-            nn.LeakyReLU(0.2, inplace=True) if act else nn.Identity(),
+            nn.LeakyReLU(0.2) if act else nn.Identity(),
             nn.Dropout(0.1) if dropout else nn.Identity()
         )
 
@@ -55,7 +56,7 @@ class ResNetBlock(nn.Module):
                 LinearBlock(dim, dim, False, False, False)
             )
 
-        self.act = nn.LeakyReLU(0.2, inplace=True)
+        self.act = nn.LeakyReLU(0.2)
     
     def forward(self, x):
         return self.act(x + self.fc(x))
@@ -109,8 +110,9 @@ class MemoryBlock(nn.Module):
         self.z_dim = z_dim
         self.shrink_thres = shrink_thres
         self.temperature = temperature
-        self.mem = torch.randn(self.mem_dim, self.z_dim)
-        self.mem_ptr = torch.zeros(1, dtype=torch.long)
+        # the memory follows the module across devices, the pointer stays on the host
+        self.register_buffer('mem', torch.randn(self.mem_dim, self.z_dim))
+        self.mem_ptr = 0
 
         self._init_parameters()
 
@@ -121,14 +123,12 @@ class MemoryBlock(nn.Module):
     @torch.no_grad()
     def update_mem(self, z):
         batch_size = z.shape[0]  # z, B x C
-        ptr = int(self.mem_ptr)
+        ptr = self.mem_ptr
         assert self.mem_dim % batch_size == 0
 
         # replace the keys at ptr (dequeue and enqueue)
         self.mem[ptr:ptr + batch_size, :] = z  # mem, M x C
-        ptr = (ptr + batch_size) % self.mem_dim  # move pointer
-
-        self.mem_ptr[0] = ptr
+        self.mem_ptr = (ptr + batch_size) % self.mem_dim  # move pointer
 
     def hard_shrink_relu(self, x, lambd=0, epsilon=1e-12):
         x = (F.relu(x-lambd) * x) / (torch.abs(x - lambd) + epsilon)
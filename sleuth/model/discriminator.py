@@ -1,12 +1,15 @@
 import torch
 import torch.nn as nn
 import torch.autograd as autograd
-from torch.autograd import Variable
 
 from .block import SNLinearBlock, ResNetBlock
 
 
 class Discriminator(nn.Module):
+    """
+    Critic without batch statistics, each sample is scored independently,
+    so real and fake samples can be passed through it as one batch.
+    """
     def __init__(self, in_dim, hidden_dim=[512, 64], num_blocks=1):
         super().__init__()
 
@@ -24,6 +27,7 @@ class Discriminator(nn.Module):
 
         self.in_dim = in_dim
         self.hidden_dim = hidden_dim
+        self.register_buffer('_eta', torch.empty(0), persistent=False)
     
         # Additional initialization
         self._init_weights()
@@ -35,23 +39,23 @@ class Discriminator(nn.Module):
     
     def gradient_penalty(self, real_data, fake_data):
         shapes = [1 if i != 0 else real_data.size(i) for i in range(real_data.dim())]
-        cuda = True if torch.cuda.is_available() else False
 
-        eta = torch.FloatTensor(*shapes).uniform_(0, 1)
-        eta = eta.cuda() if cuda else eta
+        # reuse the interpolation weights instead of allocating them every step
+        if self._eta.shape != torch.Size(shapes):
+            self._eta = real_data.new_empty(shapes)
+        eta = self._eta.uniform_(0, 1)
+
         interpolated = eta * real_data + ((1 - eta) * fake_data)
-        interpolated = interpolated.cuda() if cuda else interpolated
 
         # define it to calculate gradient
-        interpolated = Variable(interpolated, requires_grad=True)
+        interpolated.requires_grad_(True)
 
         # calculate probability of interpolated examples
         prob_interpolated = self.forward(interpolated)
 
         # calculate gradients of probabilities with respect to examples
         grad = autograd.grad(outputs=prob_interpolated, inputs=interpolated,
-                             grad_outputs=torch.ones(prob_interpolated.size()).cuda()
-                             if cuda else torch.ones(prob_interpolated.size()),
+                             grad_outputs=torch.ones_like(prob_interpolated),
                              create_graph=True, retain_graph=True)[0]
 
         grad_penalty = ((grad.norm(2, dim=1) - 1) ** 2).mean()
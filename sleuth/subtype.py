@@ -3,11 +3,10 @@ from tqdm import tqdm
 
 import torch
 import torch.nn as nn
-import torch.optim as optim
 from torch.utils.data import Dataset, DataLoader
 from torch.optim.lr_scheduler import CosineAnnealingLR
 
-from ._utils import seed_everything
+from ._utils import seed_everything, allow_tf32, should_log, to_tensor, build_adam
 from .model import GeneratorAD, Cluster
 from .configs import SubtypeConfigs
 
@@ -30,7 +29,10 @@ class SubtypeModel:
         self.batch_size = configs.batch_size
         self.learning_rate = configs.learning_rate
         self.weight_decay = configs.weight_decay
+        self.log_interval = configs.log_interval
         self.device = configs.device
+        if self.device.type == 'cuda':
+            allow_tf32()
 
         # Trained generator
         self.G = generator
@@ -42,14 +44,12 @@ class SubtypeModel:
     
     def _init_model(self, configs: SubtypeConfigs, generator: GeneratorAD, num_types: int):
         self.C = Cluster(generator, num_types, **configs.Cluster).to(self.device)
-        self.opt_C = optim.Adam(self.C.parameters(), 
-                                lr=self.learning_rate, 
-                                betas=(0.5, 0.999),
+        self.opt_C = build_adam(self.C.parameters(), self.learning_rate, self.device,
                                 weight_decay=self.weight_decay)
         self.sch_C = CosineAnnealingLR(self.opt_C, self.n_epochs)
 
     def fit(self, adata: ad.AnnData):
-        data = torch.Tensor(adata.X).to(self.device)
+        data = to_tensor(adata.X).to(self.device)
         z, res = self.generate_z_res(data)
 
         self.C.mu_init(z.cpu().detach().numpy())
@@ -73,19 +73,20 @@ class SubtypeModel:
     
     def _train(self, epochs):
         with tqdm(total=epochs) as t:
-            for _ in range(epochs):
+            for epoch in range(epochs):
                 t.set_description('CLustering Epochs')
 
                 for batch_z, batch_res in self.dataloader:
                     _, q = self.C(batch_z, batch_res)
                     p = self.C.target_distribution(q).data
 
-                    self.opt_C.zero_grad()
+                    self.opt_C.zero_grad(set_to_none=True)
                     Loss = self.C.loss_function(p, q)
                     Loss.backward(retain_graph=True)
                     self.opt_C.step()
                 
-                t.set_postfix(Loss = Loss.item())
+                if should_log(epoch, epochs, self.log_interval):
+                    t.set_postfix(Loss = Loss.item())
                 t.update(1)
                 self.sch_C.step()
 